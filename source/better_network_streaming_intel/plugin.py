@@ -43,15 +43,113 @@
 
 import logging
 import os
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
 import warnings
-from typing import Dict, List
+from typing import Dict, List, Mapping
 
 from unmanic.libs.unplugins.settings import PluginSettings
 from better_network_streaming_intel.lib.ffmpeg import Parser, Probe, StreamMapper
 
 logger = logging.getLogger("Unmanic.Plugin.better_network_streaming_intel")
 
+# Shared, read-only form visibility values
+FORM_VISIBLE = MappingProxyType({})
+FORM_HIDDEN = MappingProxyType({"display": 'hidden'})
+
+# Source codecs that have a QSV decoder, used to keep decoded frames in GPU memory
+QSV_DECODERS = MappingProxyType({
+    "h264":       "h264_qsv",
+    "hevc":       "hevc_qsv",
+    "mpeg2video": "mpeg2_qsv",
+    "vc1":        "vc1_qsv",
+    "vp8":        "vp8_qsv",
+    "vp9":        "vp9_qsv",
+    "av1":        "av1_qsv",
+    "mjpeg":      "mjpeg_qsv",
+})
+
+# HEVC streams with these profiles and pixel formats play wherever the hevc_qsv output does,
+# so they can be copied. Other profiles (4:2:2, 4:4:4, 12 bit) are re-encoded.
+COPYABLE_HEVC_PROFILES = frozenset({"Main", "Main 10"})
+COPYABLE_PIX_FMTS = frozenset({"yuv420p", "yuv420p10le"})
+
+# CPU video filters, applied in this order when their toggle setting is enabled.
+# The crop window is given in the coordinates of the scaled frame, so the crop follows the scale.
+# Frames and pixels are dropped first so the denoise runs on as little data as possible.
+CPU_VIDEO_FILTERS = (
+    ("Change FPS",          "fps="),
+    ("Change Resolution",   "scale="),
+    ("Crop Window",         "crop="),
+    ("Enable Video Filter", "hqdn3d="),
+)
+
+# Constant ffmpeg argument fragments
+QSV_HWACCEL_ARGS = ("-hwaccel", "qsv", "-hwaccel_output_format", "qsv")
+QSV_ENCODER_ARGS = ("-c:v:0", "hevc_qsv")
+AUDIO_COPY_ARGS = ("-c:a:0", "copy")
+AAC_ENCODER_ARGS = ("-c:a:0", "aac")
+AAC_OUTPUT_ARGS = ("-b:a", "192k", "-ac", "2")
+
+# Form settings that do not depend on the configured values, built once at import
+STATIC_FORM_SETTINGS = {
+    "-preset": {
+        "input_type":     "select",
+        "select_options": [
+            {'value': preset, 'label': preset}
+            for preset in ("veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow")
+        ],
+    },
+    "Container": {
+        "input_type":     "select",
+        "select_options": [
+            {
+                'value': ".mp4",
+                'label': "mp4",
+            },
+            {
+                'value': ".mkv",
+                'label': "mkv",
+            },
+        ],
+    },
+    "Rate Control Mode": {
+        "input_type":     "select",
+        "select_options": [
+            {"value": "CQP", "label": "CQP (Constant Quality)"},
+            {"value": "VBR", "label": "VBR (Bitrate)"},
+        ],
+    },
+    "-look_ahead_depth": {
+        "label": "lookahead frames",
+        "input_type":     "slider",
+        "slider_options": {
+            "min":    4,
+            "max":    100,
+            "step":   1,
+        },
+    },
+    "-async_depth": {
+        "label": "async depth",
+        "input_type":     "slider",
+        "slider_options": {
+            "min":    1,
+            "max":    16,
+            "step":   1,
+        },
+    },
+    "-threads": {
+        "label": "threads (0 = let ffmpeg decide)",
+        "input_type":     "slider",
+        "slider_options": {
+            "min":    0,
+            "max":    os.cpu_count() or 1,
+            "step":   1,
+        },
+    },
+}
+
 class Settings(PluginSettings):
     """
     An object to hold a dictionary of settings accessible to the Plugin
@@ -92,91 +190,37 @@ class Settings(PluginSettings):
         "-b:v": "1000",
         "-maxrate": 1000,
         "-bufsize": 2000,
-        "-preset": "veryslow",
+        "Extended Bitrate Control": False,
+        "-preset": "slow",
+        "-async_depth": 4,
         ## audio config ##
         "Copy Audio": True,
         "Enable Audio Filter": False,
         "-af": "highpass=200,lowpass=3000,afftdn",
         ## packaging ##
         "Container": ".mp4",
+        "Fragmented MP4": True,
+        ## performance ##
+        "-threads": 0,
     }
 
     def __init__(self, *args, **kwargs):
         super(Settings, self).__init__(*args, **kwargs)
+        # Look the rate control mode up once for all the fields that depend on it
+        show_when_cqp = self.__show_when_rate_control("CQP")
+        show_when_vbr = self.__show_when_rate_control("VBR")
         self.form_settings = {
+            **STATIC_FORM_SETTINGS,
             "vpp_qsv_denoise=": self.__show_when_gpu_decoding("Enable Video Filter"),
             "scale_qsv=": self.__show_when_gpu_decoding("Change Resolution"),
             "hqdn3d=": self.__show_when_cpu_decoding("Enable Video Filter"),
             "scale=": self.__show_when_cpu_decoding("Change Resolution"),
             "fps=": self.__show_when_cpu_decoding("Change FPS"),
             "vpp_qsv_framerate=": self.__show_when_gpu_decoding("Change FPS"),
-            "crop=": self.__show_when_cpu_decoding("Crop Window"),
-            "Crop Window": self.__hidden_when("Enable Hardware Decoding"),
-            "-preset": {
-                "input_type":     "select",
-                "select_options": [
-                    {
-                        'value': "veryfast",
-                        'label': "veryfast",
-                    },
-                    {
-                        'value': "faster",
-                        'label': "faster",
-                    },
-                    {
-                        'value': "fast",
-                        'label': "fast",
-                    },
-                    {
-                        'value': "medium",
-                        'label': "medium",
-                    },
-                    {
-                        'value': "slow",
-                        'label': "slow",
-                    },
-                    {
-                        'value': "slower",
-                        'label': "slower",
-                    },
-                    {
-                        'value': "veryslow",
-                        'label': "veryslow",
-                    },
-                ],
-            },
-            "Container":{
-                "input_type":     "select",
-                "select_options": [
-                    {
-                        'value': ".mp4",
-                        'label': "mp4",
-                    },
-                    {
-                        'value': ".mkv",
-                        'label': "mkv",
-                    },
-                ],
-            },
-            "Rate Control Mode": {
-                "input_type":     "select",
-                "select_options": [
-                    {"value": "CQP", "label": "CQP (Constant Quality)"},
-                    {"value": "VBR", "label": "VBR (Bitrate)"},
-                ],
-            },
-            "-look_ahead_depth": {
-                "label": "lookahead frames",
-                "input_type":     "slider",
-                "slider_options": {
-                    "min":    4,
-                    "max":    100,
-                    "step":   1,
-                },
-            },
+            "crop=": self.__show_when("Crop Window"),
             "-global_quality": {
                 "label": "global_quality",
-                **self.__show_when_rate_control("CQP"),
+                **show_when_cqp,
                 "input_type":     "slider",
                 "slider_options": {
                     "min":    1,
@@ -186,7 +230,7 @@ class Settings(PluginSettings):
             },
             "-b:v": {
                 "label": "target bitrate",
-                **self.__show_when_rate_control("VBR"),
+                **show_when_vbr,
                 "input_type":     "slider",
                 "slider_options": {
                     "min":    100,
@@ -197,7 +241,7 @@ class Settings(PluginSettings):
             },
             "-maxrate": {
                 "label": "maxrate",
-                **self.__show_when_rate_control("VBR"),
+                **show_when_vbr,
                 "input_type":     "slider",
                 "slider_options": {
                     "min":    100,
@@ -208,7 +252,7 @@ class Settings(PluginSettings):
             },
             "-bufsize": {
                 "label": "bufsize",
-                **self.__show_when_rate_control("VBR"),
+                **show_when_vbr,
                 "input_type":     "slider",
                 "slider_options": {
                     "min":    200,
@@ -217,43 +261,37 @@ class Settings(PluginSettings):
                     "suffix": "k"
                 },
             },
-            "Enable Audio Filter": self.__hidden_when("Copy Audio"),
+            "Extended Bitrate Control": show_when_vbr,
+            "Fragmented MP4": self.__show_when_container(".mp4"),
+            "Enable Audio Filter": self.__show_when("Copy Audio", inverted=True),
             "-af": self.__show_when("Enable Audio Filter"),
         }
 
-    def __show_when_gpu_decoding(self, key) -> Dict:
-        values = {
-            "display": 'hidden'
-        }
+    def __show_when_gpu_decoding(self, key) -> Mapping:
         if self.get_setting("Enable Hardware Decoding") and self.get(key):
-            values = {}
-        return values
+            return FORM_VISIBLE
+        return FORM_HIDDEN
 
-    def __show_when_cpu_decoding(self, key) -> Dict:
-        values = {
-            "display": 'hidden'
-        }
+    def __show_when_cpu_decoding(self, key) -> Mapping:
         if not self.get_setting("Enable Hardware Decoding") and self.get(key):
-            values = {}
-        return values
+            return FORM_VISIBLE
+        return FORM_HIDDEN
 
-    def __show_when_rate_control(self, mode) -> Dict:
-        values = {"display": 'hidden'}
+    def __show_when_rate_control(self, mode) -> Mapping:
         if self.get_setting("Rate Control Mode") == mode:
-            values = {}
-        return values
+            return FORM_VISIBLE
+        return FORM_HIDDEN
 
-    def __show_when(self, key):
-        values = {}
-        if not self.get_setting(key):
-            values["display"] = 'hidden'
-        return values
+    def __show_when_container(self, extension) -> Mapping:
+        if self.get_setting("Container") == extension:
+            return FORM_VISIBLE
+        return FORM_HIDDEN
 
-    def __hidden_when(self, key):
-        values = {}
-        if self.get_setting(key):
-            values["display"] = 'hidden'
-        return values
+    def __show_when(self, key, inverted=False) -> Mapping:
+        """Show the form field when the key setting is enabled, or when it is disabled if inverted"""
+        if bool(self.get_setting(key)) != inverted:
+            return FORM_VISIBLE
+        return FORM_HIDDEN
 
     def get(self, key, default_value=""):
         value = super(Settings, self).get_setting(key)
@@ -270,20 +308,53 @@ class PluginStreamMapper(StreamMapper):
         )
         self.found_video = False
         self.found_audio = False
+        self.video_copied = False
 
-    def set_settings(self, setting: Settings):
+    def set_settings(self, setting: Dict):
         self.setting = setting
         self.stream_types = []
 
-        if not setting.get("Copy Video"):
+        if not setting["Copy Video"]:
             self.stream_types.append("video")
 
-        if not setting.get("Copy Audio"):
+        if not setting["Copy Audio"]:
             self.stream_types.append("audio")
 
     def test_stream_needs_processing(self, stream_info: Dict):
         return stream_info.get("codec_type") in self.stream_types
 
+    def __video_encoding_args(self) -> List:
+        """
+        Build the filter and hevc_qsv encoder arguments for the mapped video stream.
+
+        :return: list
+        """
+        if self.setting["Enable Hardware Decoding"]:
+            # GPU filter chain using vpp_qsv
+            vpp_qsv = build_vpp_qsv(self.setting)
+            if vpp_qsv:
+                vf_param = ["-vf", vpp_qsv]
+            else:
+                vf_param = []
+        else:
+            # CPU filter chain
+            vf_param = build_filter_args(self.setting, CPU_VIDEO_FILTERS)
+
+        # Unknown modes fall back to constant quality
+        build_rate_args = RATE_CONTROL_BUILDERS.get(self.setting["Rate Control Mode"], build_cqp_args)
+        rate_args = build_rate_args(self.setting)
+
+        encoding_args = vf_param
+        encoding_args.extend(QSV_ENCODER_ARGS)
+        encoding_args.extend((
+            "-async_depth", f"{self.setting['-async_depth']}",
+            "-look_ahead", "1",
+            "-look_ahead_depth", f"{self.setting['-look_ahead_depth']}",
+        ))
+        encoding_args.extend(rate_args)
+        encoding_args.extend(("-preset", self.setting["-preset"]))
+        return encoding_args
+
     def custom_stream_mapping(self, stream_info: Dict, stream_id: int):
         """
         Will be provided with stream_info and the stream_id of a stream that has been
@@ -317,62 +388,20 @@ class PluginStreamMapper(StreamMapper):
             if self.found_video:
                 logger.warning(f"a video track has been founded, track {stream_id} will be delete")
             else:
-                self.stream_mapping += [
+                stream_mapping = [
                     "-map", f"0:v:{stream_id}",
                     "-disposition:v:0", "default"
                 ]
 
-                if self.setting.get("Enable Hardware Decoding"):
-                    # GPU filter chain using vpp_qsv
-                    vpp_qsv_parts = []
-                    if self.setting.get("Enable Video Filter"):
-                        vpp_qsv_parts.append("denoise=" + self.setting.get("vpp_qsv_denoise="))
-                    if self.setting.get("Change Resolution"):
-                        parts = self.setting.get("scale_qsv=").split(":")
-                        if len(parts) == 2:
-                            vpp_qsv_parts.append("w=" + parts[0] + ":h=" + parts[1])
-                    if self.setting.get("Change FPS"):
-                        vpp_qsv_parts.append("framerate=" + self.setting.get("vpp_qsv_framerate="))
-                    if len(vpp_qsv_parts) > 0:
-                        vf_param = ["-vf", "vpp_qsv=" + ":".join(vpp_qsv_parts)]
-                    else:
-                        vf_param = []
-                else:
-                    # CPU filter chain
-                    vf_param = []
-                    def vf_adder(condition, key):
-                        if self.setting.get(condition):
-                            vf_param.append(
-                                key + self.setting.get(key)
-                            )
-                    vf_adder("Enable Video Filter", "hqdn3d=")
-                    vf_adder("Change Resolution", "scale=")
-                    vf_adder("Change FPS", "fps=")
-                    vf_adder("Crop Window", "crop=")
-                    if len(vf_param) > 0:
-                        vf_param = [
-                            "-vf", ",".join(vf_param)
-                        ]
-
-                ld = self.setting.get("-look_ahead_depth")
-
-                if self.setting.get("Rate Control Mode") == "VBR":
-                    br = str(self.setting.get("-b:v")) + 'k'
-                    mr = str(self.setting.get("-maxrate")) + 'k'
-                    bs = str(self.setting.get("-bufsize")) + 'k'
-                    rate_args = ["-b:v", br, "-maxrate", mr, "-bufsize", bs]
+                if is_compliant_video(stream_info, self.probe.get("format", {}), self.setting):
+                    # Already HEVC within the bitrate cap, re-encoding would only cost time
+                    logger.info("Video stream {} already meets the output settings, copying it".format(stream_id))
+                    stream_encoding = [
+                        "-c:v:0", "copy"
+                    ]
+                    self.video_copied = True
                 else:
-                    gq = str(self.setting.get("-global_quality"))
-                    rate_args = ["-global_quality", gq]
-
-                stream_encoding = [
-                    *vf_param,
-                    "-c:v:0", "hevc_qsv",
-                    "-look_ahead", "1",
-                    "-look_ahead_depth", ld,
-                    *rate_args,
-                    "-preset", self.setting.get("-preset"),
-                ]
+                    stream_encoding = self.__video_encoding_args()
 
                 self.found_video = True
 
@@ -380,25 +409,17 @@ class PluginStreamMapper(StreamMapper):
             if self.found_audio:
                 logger.warning(f"a audio track has been founded, track {stream_id} will be delete")
             else:
-                self.stream_mapping += [
+                stream_mapping = [
                     "-map", f"0:a:{stream_id}",
                     "-disposition:a:0", "default"
                 ]
-                if self.setting.get("Copy Audio"):
-                    stream_encoding = [
-                        "-c:a:0", "copy"
-                    ]
+                if self.setting["Copy Audio"]:
+                    stream_encoding = list(AUDIO_COPY_ARGS)
                 else:
-                    stream_encoding = [
-                        "-c:a:0", "aac"
-                    ]
-                    if self.setting.get("Enable Audio Filter"):
-                        stream_encoding.extend(
-                            ["-af", self.setting.get("-af")]
-                        )
-                    stream_encoding.extend(
-                        ["-b:a", "192k", "-ac", "2"]
-                    )
+                    stream_encoding = list(AAC_ENCODER_ARGS)
+                    if self.setting["Enable Audio Filter"]:
+                        stream_encoding.extend(("-af", self.setting["-af"]))
+                    stream_encoding.extend(AAC_OUTPUT_ARGS)
                 self.found_audio = True
 
         else:
@@ -407,6 +428,153 @@ class PluginStreamMapper(StreamMapper):
         return {"stream_mapping": stream_mapping, "stream_encoding": stream_encoding}
 
 
+def is_compliant_video(stream_info: Dict, format_info: Dict, settings: Dict) -> bool:
+    """
+    Check if a video stream already matches the configured output, meaning it is
+    HEVC with a 4:2:0 Main or Main 10 profile, no video filter is enabled, and its
+    bitrate is within the VBR maxrate. Such a stream can be copied instead of re-encoded.
+
+    :param stream_info:
+    :param format_info:
+    :param settings:
+    :return: bool
+    """
+    if stream_info.get("codec_name") != "hevc":
+        return False
+    if stream_info.get("profile") not in COPYABLE_HEVC_PROFILES:
+        return False
+    if stream_info.get("pix_fmt") not in COPYABLE_PIX_FMTS:
+        return False
+    if any(settings[condition] for condition, _ in CPU_VIDEO_FILTERS):
+        return False
+    if settings["Rate Control Mode"] != "VBR":
+        # The quality of a constant quality encode can not be compared from the probe
+        return False
+    # Not all containers report a per-stream bitrate, fall back to the overall bitrate
+    bit_rate = stream_info.get("bit_rate") or format_info.get("bit_rate")
+    try:
+        return int(bit_rate) <= int(settings["-maxrate"]) * 1000
+    except (TypeError, ValueError):
+        return False
+
+
+def build_cqp_args(settings: Dict) -> List:
+    """Return the hevc_qsv arguments for the CQP (constant quality) rate control mode"""
+    return ["-global_quality", f"{settings['-global_quality']}"]
+
+
+def build_vbr_args(settings: Dict) -> List:
+    """Return the hevc_qsv arguments for the VBR (bitrate) rate control mode"""
+    rate_args = [
+        "-b:v", f"{settings['-b:v']}k",
+        "-maxrate", f"{settings['-maxrate']}k",
+        "-bufsize", f"{settings['-bufsize']}k",
+    ]
+    if settings["Extended Bitrate Control"]:
+        # Let the look-ahead drive the bitrate controller for better quality per bit
+        rate_args.extend(("-extbrc", "1"))
+    return rate_args
+
+
+# Rate control argument builders for each "Rate Control Mode"
+RATE_CONTROL_BUILDERS = MappingProxyType({
+    "CQP": build_cqp_args,
+    "VBR": build_vbr_args,
+})
+
+
+def build_filter_args(settings: Dict, video_filters) -> List:
+    """
+    Join the enabled filters of a filter table into a single -vf argument.
+
+    :param settings:
+    :param video_filters: a table of (toggle setting, filter setting) pairs
+    :return: list - the -vf arguments, or an empty list when no filter is enabled
+    """
+    vf = ",".join(
+        key + settings[key]
+        for condition, key in video_filters
+        if settings[condition]
+    )
+    if vf:
+        return ["-vf", vf]
+    return []
+
+
+def build_vpp_qsv(settings: Dict) -> str:
+    """
+    Build a single vpp_qsv filter covering crop, denoise, scale and framerate
+    so that frames decoded by QSV never leave GPU memory.
+
+    :param settings:
+    :return: str - the vpp_qsv filter, or an empty string when no filter is enabled
+    """
+    return compose_vpp_qsv(
+        settings["crop="] if settings["Crop Window"] else None,
+        settings["vpp_qsv_denoise="] if settings["Enable Video Filter"] else None,
+        settings["scale_qsv="] if settings["Change Resolution"] else None,
+        settings["vpp_qsv_framerate="] if settings["Change FPS"] else None,
+    )
+
+
+@lru_cache(maxsize=32)
+def compose_vpp_qsv(crop, denoise, scale, framerate) -> str:
+    """
+    Compose the vpp_qsv filter from the values of the enabled filters (None when disabled).
+    The settings rarely change between tasks, so the result is cached.
+
+    :param crop:
+    :param denoise:
+    :param scale:
+    :param framerate:
+    :return: str
+    """
+    vpp_qsv_parts = []
+    crop_option = ""
+    if crop is not None:
+        parts = crop.split(":")
+        if len(parts) == 4:
+            crop_option = "cw={}:ch={}:cx={}:cy={}".format(*parts)
+    # vpp_qsv crops before it scales, while the crop window is given in the coordinates
+    # of the scaled frame. Without a scale the crop can share the same vpp_qsv.
+    if crop_option and scale is None:
+        vpp_qsv_parts.append(crop_option)
+    if denoise is not None:
+        vpp_qsv_parts.append("denoise=" + denoise)
+    if scale is not None:
+        parts = scale.split(":")
+        if len(parts) == 2:
+            vpp_qsv_parts.append("w=" + parts[0] + ":h=" + parts[1])
+    if framerate is not None:
+        vpp_qsv_parts.append("framerate=" + framerate)
+    vpp_qsv_filters = []
+    if len(vpp_qsv_parts) > 0:
+        vpp_qsv_filters.append("vpp_qsv=" + ":".join(vpp_qsv_parts))
+    if crop_option and scale is not None:
+        vpp_qsv_filters.append("vpp_qsv=" + crop_option)
+    return ",".join(vpp_qsv_filters)
+
+
+def get_video_codec(probe: Probe) -> str:
+    """Return the codec name of the first video stream in the probe, or an empty string"""
+    for stream_info in probe.get("streams", []):
+        if stream_info.get("codec_type") == "video":
+            return stream_info.get("codec_name", "")
+    return ""
+
+
+def get_thread_count(settings: Dict) -> int:
+    """
+    Return the number of ffmpeg threads to use.
+    Unmanic does not tell plugins how many workers run in parallel, so when the
+    setting is left at 0 ffmpeg keeps its own per decoder and filter defaults.
+
+    :param settings:
+    :return: int - 0 when ffmpeg should pick the thread counts
+    """
+    return max(0, int(settings["-threads"]))
+
+
 def on_worker_process(data: Dict):
     """
     Runner function - enables additional configured processing jobs during the worker stages of a task.
@@ -437,33 +605,62 @@ def on_worker_process(data: Dict):
     else:
         settings = Settings()
 
+    # Snapshot all settings once rather than reading them back on every lookup
+    settings_dict = settings.get_setting()
+
     # Get stream mapper
     mapper = PluginStreamMapper()
-    mapper.set_settings(settings)
+    mapper.set_settings(settings_dict)
     mapper.set_probe(probe)
 
-    mapper.streams_need_processing()
+    needs_processing = mapper.streams_need_processing()
+    if needs_processing and mapper.video_copied and settings_dict["Copy Audio"]:
+        # The video stream is copied as it is, so only dropping extra video streams would change the file
+        needs_processing = mapper.video_stream_count > 1
 
     mapper.set_input_file(abspath)
 
-    base, _ = os.path.splitext(data.get("file_out"))
-    file_out = base + settings.get("Container")
+    # Skip the task when every stream would be copied into the same container
+    if not needs_processing and not mapper.container_needs_remuxing(settings_dict["Container"]):
+        logger.info("File '{}' already matches the output settings, nothing to do".format(abspath))
+        return data
+
+    # Swap the extension for the configured container, ignoring dots in the directory names
+    file_out = data.get("file_out")
+    dot = file_out.rfind(".")
+    if dot > file_out.rfind(os.sep):
+        file_out = file_out[:dot]
+    file_out += settings_dict["Container"]
     mapper.set_output_file(file_out)
     data["file_out"] = file_out
 
-    # Add faststart as an advanced option
-    mapper.set_ffmpeg_advanced_options("-movflags", "+faststart")
+    # Limit the decoder and filter threads of this worker
+    threads = get_thread_count(settings_dict)
+    if threads > 0:
+        mapper.generic_options += ["-threads", f"{threads}", "-filter_threads", f"{threads}"]
+
+    # The mp4 muxer options are ignored by other containers. Fragmenting writes
+    # the file in a single pass instead of rewriting the moov atom at the end,
+    # the muxer disables faststart when it is combined with fragmentation.
+    if settings_dict["Container"] == ".mp4":
+        if settings_dict["Fragmented MP4"]:
+            mapper.set_ffmpeg_advanced_options("-movflags", "+frag_keyframe+empty_moov")
+        else:
+            mapper.set_ffmpeg_advanced_options("-movflags", "+faststart")
 
     # Enable QSV hardware decoding if configured
-    if settings.get("Enable Hardware Decoding"):
-        mapper.generic_options += ["-hwaccel", "qsv", "-hwaccel_output_format", "qsv"]
+    if settings_dict["Enable Hardware Decoding"] and not settings_dict["Copy Video"] and not mapper.video_copied:
+        mapper.generic_options.extend(QSV_HWACCEL_ARGS)
+        # Select the matching QSV decoder so decoding never falls back to software
+        decoder = QSV_DECODERS.get(get_video_codec(probe))
+        if decoder:
+            mapper.generic_options += ["-c:v", decoder]
     
     ffmpeg_args = mapper.get_ffmpeg_args()
     logger.debug("ffmpeg_args: '{}'".format(ffmpeg_args))
 
     # Apply ffmpeg args to command
-    data["exec_command"] = ["ffmpeg"]
-    data["exec_command"] += ffmpeg_args
+    data["exec_command"] = ["ffmpeg"] + ffmpeg_args
 
     parser = Parser(logger)
     parser.set_probe(probe)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit tests for better_network_streaming_intel plugin.
+"""
+
+import unittest
+import sys
+import os
+from unittest.mock import Mock
+
+# Add the plugin directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Create mock modules
+mock_unmanic = Mock()
+mock_unmanic.libs = Mock()
+mock_unmanic.libs.unplugins = Mock()
+mock_unmanic.libs.unplugins.settings = Mock()
+
+# Mock PluginSettings class
+mock_plugin_settings_class = Mock
+mock_unmanic.libs.unplugins.settings.PluginSettings = mock_plugin_settings_class
+
+
+# Create a fake StreamMapper class with the attributes the plugin sets up
+class FakeStreamMapper:
+    """Fake StreamMapper class for testing."""
+
+    def __init__(self, logger, processing_stream_type):
+        self.logger = logger
+        self.processing_stream_type = processing_stream_type
+
+
+# Mock ffmpeg modules
+mock_ffmpeg = Mock()
+mock_ffmpeg.Parser = Mock
+mock_ffmpeg.Probe = Mock
+mock_ffmpeg.StreamMapper = FakeStreamMapper
+
+# Patch the imports
+sys.modules['unmanic'] = mock_unmanic
+sys.modules['unmanic.libs'] = mock_unmanic.libs
+sys.modules['unmanic.libs.unplugins'] = mock_unmanic.libs.unplugins
+sys.modules['unmanic.libs.unplugins.settings'] = mock_unmanic.libs.unplugins.settings
+sys.modules['better_network_streaming_intel'] = Mock()
+sys.modules['better_network_streaming_intel.lib'] = Mock()
+sys.modules['better_network_streaming_intel.lib'].ffmpeg = mock_ffmpeg
+sys.modules['better_network_streaming_intel.lib.ffmpeg'] = mock_ffmpeg
+
+# Now import the plugin
+from plugin import Settings, is_compliant_video
+
+
+def make_settings(**overrides):
+    """Return the default plugin settings for a VBR encode without filters, with some values overridden."""
+    settings = dict(Settings.settings)
+    settings.update({
+        "Enable Video Filter": False,
+        "Rate Control Mode": "VBR",
+        "-maxrate": 1000,
+    })
+    settings.update(overrides)
+    return settings
+
+
+class TestIsCompliantVideo(unittest.TestCase):
+    """Test cases for is_compliant_video."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.stream_info = {
+            "codec_type": "video",
+            "codec_name": "hevc",
+            "profile": "Main",
+            "pix_fmt": "yuv420p",
+            "bit_rate": "800000",
+        }
+        self.format_info = {"bit_rate": "900000"}
+
+    def test_compliant_video(self):
+        """Test that an HEVC Main stream within the maxrate can be copied."""
+        self.assertTrue(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_compliant_10_bit_video(self):
+        """Test that an HEVC Main 10 stream within the maxrate can be copied."""
+        self.stream_info.update(profile="Main 10", pix_fmt="yuv420p10le")
+        self.assertTrue(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_other_codec(self):
+        """Test that a stream in another codec is re-encoded."""
+        self.stream_info["codec_name"] = "h264"
+        self.stream_info["profile"] = "High"
+        self.assertFalse(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_unsupported_profile(self):
+        """Test that HEVC range extension and unknown profiles are re-encoded."""
+        self.stream_info["profile"] = "Rext"
+        self.assertFalse(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+        del self.stream_info["profile"]
+        self.assertFalse(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_unsupported_pix_fmt(self):
+        """Test that 4:2:2, 4:4:4 and unknown pixel formats are re-encoded."""
+        for pix_fmt in ("yuv422p10le", "yuv444p", None):
+            self.stream_info["pix_fmt"] = pix_fmt
+            self.assertFalse(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_bitrate_above_maxrate(self):
+        """Test that a stream above the maxrate is re-encoded."""
+        self.stream_info["bit_rate"] = "1000001"
+        self.assertFalse(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+        # The maxrate itself is still within the cap
+        self.stream_info["bit_rate"] = "1000000"
+        self.assertTrue(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_format_bitrate_fallback(self):
+        """Test that the overall bitrate is used when the stream reports none."""
+        del self.stream_info["bit_rate"]
+        self.assertTrue(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+        self.format_info["bit_rate"] = "2000000"
+        self.assertFalse(is_compliant_video(self.stream_info, self.format_info, make_settings()))
+
+    def test_unknown_bitrate(self):
+        """Test that a stream without any bitrate is re-encoded."""
+        del self.stream_info["bit_rate"]
+        self.assertFalse(is_compliant_video(self.stream_info, {}, make_settings()))
+
+    def test_video_filter_enabled(self):
+        """Test that any enabled video filter forces a re-encode."""
+        for condition in ("Enable Video Filter", "Change Resolution", "Change FPS", "Crop Window"):
+            settings = make_settings(**{condition: True})
+            self.assertFalse(is_compliant_video(self.stream_info, self.format_info, settings))
+
+    def test_constant_quality(self):
+        """Test that a constant quality encode is never skipped."""
+        settings = make_settings(**{"Rate Control Mode": "CQP"})
+        self.assertFalse(is_compliant_video(self.stream_info, self.format_info, settings))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,16 +43,136 @@
 
 import logging
 import os
+import subprocess
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
 import warnings
-from typing import Dict, List
+from typing import Dict, List, Mapping
 
 from unmanic.libs.unplugins.settings import PluginSettings
-from unmanic.libs.system import System
 from steam_selector.lib.ffmpeg import Parser, Probe, StreamMapper
 
 logger = logging.getLogger("Unmanic.Plugin.better_network_streaming_nvidia")
 
+# Shared, read-only form visibility values
+FORM_VISIBLE = MappingProxyType({})
+FORM_HIDDEN = MappingProxyType({"display": 'hidden'})
+
+# Source codecs that have a CUVID decoder, used to keep decoded frames in GPU memory
+CUVID_DECODERS = MappingProxyType({
+    "h264":       "h264_cuvid",
+    "hevc":       "hevc_cuvid",
+    "mpeg1video": "mpeg1_cuvid",
+    "mpeg2video": "mpeg2_cuvid",
+    "mpeg4":      "mpeg4_cuvid",
+    "vc1":        "vc1_cuvid",
+    "vp8":        "vp8_cuvid",
+    "vp9":        "vp9_cuvid",
+    "av1":        "av1_cuvid",
+    "mjpeg":      "mjpeg_cuvid",
+})
+
+# Video filters, applied in this order when their toggle setting is enabled.
+# The crop window is given in the coordinates of the scaled frame, so the crop follows the scale.
+# Frames and pixels are dropped first so the denoise runs on as little data as possible.
+# With hardware decoding the crop is done by the CUVID decoder instead, which is only possible without a scale.
+GPU_VIDEO_FILTERS = (
+    ("Change FPS",          "fps="),
+    ("Change Resolution",   "scale_cuda="),
+    ("Enable Video Filter", "bilateral_cuda="),
+)
+CPU_VIDEO_FILTERS = (
+    ("Change FPS",          "fps="),
+    ("Change Resolution",   "scale="),
+    ("Crop Window",         "crop="),
+    ("Enable Video Filter", "hqdn3d="),
+)
+
+# Constant ffmpeg argument fragments
+# One named CUDA device is shared by the decoder and the filters.
+# A few extra decoder surfaces let the GPU filters hold frames without stalling the decoder.
+CUDA_HWACCEL_ARGS = (
+    "-init_hw_device", "cuda=cu:0", "-filter_hw_device", "cu",
+    "-hwaccel", "cuda", "-hwaccel_device", "cu", "-hwaccel_output_format", "cuda",
+    "-extra_hw_frames", "8",
+)
+# NVENC does the encoding work, a single CPU thread is enough to feed it.
+# The thread count is scoped to the video stream so the audio encoder keeps its own.
+NVENC_ENCODER_ARGS = ("-c:v:0", "hevc_nvenc", "-threads:v:0", "1")
+NVENC_VBR_ARGS = ("-rc", "vbr")
+NVENC_CONSTQP_ARGS = ("-rc", "constqp")
+NVENC_AQ_ARGS = ("-spatial-aq", "1", "-temporal-aq", "1")
+# CPU encoder used when the ffmpeg build has no hevc_nvenc, x265 picks its own thread count
+X265_ENCODER_ARGS = ("-c:v:0", "libx265")
+AAC_ENCODER_ARGS = ("-c:a:0", "aac")
+AAC_OUTPUT_ARGS = ("-b:a", "192k", "-ac", "2")
+
+# Preset used for the output height when -preset is left at its default.
+# Above 1080p the slowest preset costs far more time for little quality gain.
+PRESET_BY_HEIGHT = (
+    (1440, "p6"),
+    (0,    "p7"),
+)
+
+# x265 preset with roughly the same speed/quality trade off as each NVENC preset
+X265_PRESETS = MappingProxyType({
+    "p2": "veryfast",
+    "p5": "fast",
+    "p6": "medium",
+    "p7": "slow",
+})
+
+# Form settings that do not depend on the configured values, built once at import
+STATIC_FORM_SETTINGS = {
+    "-preset": {
+        "input_type":     "select",
+        "select_options": [
+            {'value': preset, 'label': preset}
+            for preset in ("p2", "p5", "p6", "p7")
+        ],
+    },
+    "Container": {
+        "input_type":     "select",
+        "select_options": [
+            {
+                'value': ".mp4",
+                'label': "mp4",
+            },
+            {
+                'value': ".mkv",
+                'label': "mkv",
+            },
+        ],
+    },
+    "-cq": {
+        "label": "Constant Quality",
+        "input_type":     "slider",
+        "slider_options": {
+            "min":    1,
+            "max":    51,
+            "step":   1
+        },
+    },
+    "-multipass": {
+        "input_type":     "select",
+        "select_options": [
+            {"value": "disabled", "label": "disabled"},
+            {"value": "qres", "label": "qres (quarter resolution first pass)"},
+            {"value": "fullres", "label": "fullres (full resolution first pass)"},
+        ],
+    },
+    "-threads": {
+        "label": "threads (0 = let ffmpeg decide)",
+        "input_type":     "slider",
+        "slider_options": {
+            "min":    0,
+            "max":    os.cpu_count() or 1,
+            "step":   1,
+        },
+    },
+}
+
 class Settings(PluginSettings):
     """
     An object to hold a dictionary of settings accessible to the Plugin
@@ -87,72 +207,49 @@ class Settings(PluginSettings):
         ## video decoding config ##
         "-preset": "p7",
         "-cq": 25,
+        "Constant QP": False,
         "-qmin": 25,
         "-qmax": 25,
         "-rc-lookahead": 32,
+        "Adaptive Quantization": False,
+        "-multipass": "disabled",
+        "Advanced NVENC": False,
+        "-tune": "hq",
+        "-bf": 3,
+        "-b_ref_mode": "middle",
         ## audio config ##
         "Copy Audio": True,
         "Enable Audio Filter": False,
         "-af": "highpass=200,lowpass=3000,afftdn",
         ## packaging ##
         "Container": ".mp4",
+        "Fragmented MP4": True,
+        ## performance ##
+        "-threads": 0,
     }
 
     def __init__(self, *args, **kwargs):
         super(Settings, self).__init__(*args, **kwargs)
         self.form_settings = {
+            **STATIC_FORM_SETTINGS,
             "bilateral_cuda=":  self.__show_when_gpu_decoding("Enable Video Filter"),
             "scale_cuda=":  self.__show_when_gpu_decoding("Change Resolution"),
             "hqdn3d=": self.__show_when_cpu_decoding("Enable Video Filter"),
             "scale=": self.__show_when_cpu_decoding("Change Resolution"),
-            "Change FPS": self.__hidden_when("Enable Hardware Decoding"),
-            "fps=": self.__show_when_cpu_decoding("Change FPS"),
-            "Crop Window": self.__hidden_when("Enable Hardware Decoding"),
-            "crop=": self.__show_when_cpu_decoding("Crop Window"),
-            "-preset": {
-                "input_type":     "select",
-                "select_options": [
-                    {
-                        'value': "p2",
-                        'label': "p2",
-                    },
-                    {
-                        'value': "p5",
-                        'label': "p5",
-                    },
-                    {
-                        'value': "p6",
-                        'label': "p6",
-                    },
-                    {
-                        'value': "p7",
-                        'label': "p7",
-                    },
-                ],
-            },
-            "Container":{
-                "input_type":     "select",
-                "select_options": [
-                    {
-                        'value': ".mp4",
-                        'label': "mp4",
-                    },
-                    {
-                        'value': ".mkv",
-                        'label': "mkv",
-                    },
-                ],
-            },
-            "-cq": {
-                "label": "Constant Quality",
+            "fps=": self.__show_when("Change FPS"),
+            "crop=": self.__show_when("Crop Window"),
+            "-rc-lookahead": {
+                **self.__show_when("Constant QP", inverted=True),
+                "label": "lookahead frames",
                 "input_type":     "slider",
                 "slider_options": {
-                    "min":    1,
-                    "max":    51,
+                    "min":    4,
+                    "max":    64,
                     "step":   1
                 },
             },
             "-qmin": {
+                **self.__show_when("Constant QP", inverted=True),
                 "input_type":     "slider",
                 "slider_options": {
                     "min":    1,
@@ -161,6 +258,7 @@ class Settings(PluginSettings):
                 },
             },
             "-qmax": {
+                **self.__show_when("Constant QP", inverted=True),
                 "input_type":     "slider",
                 "slider_options": {
                     "min":    1,
@@ -168,47 +266,59 @@ class Settings(PluginSettings):
                     "step":   1
                 },
             },
-            "-rc-lookahead": {
-                "label": "lookahead frames",
+            "-tune": {
+                **self.__show_when("Advanced NVENC"),
+                "input_type":     "select",
+                "select_options": [
+                    {'value': tune, 'label': tune}
+                    for tune in ("hq", "ll", "ull", "lossless")
+                ],
+            },
+            "-bf": {
+                "label": "B-frames (0 for GPUs without HEVC B-frame support)",
+                **self.__show_when("Advanced NVENC"),
                 "input_type":     "slider",
                 "slider_options": {
-                    "min":    4,
-                    "max":    64,
+                    "min":    0,
+                    "max":    4,
                     "step":   1
                 },
             },
-            "Enable Audio Filter": self.__hidden_when("Copy Audio"),
+            "-b_ref_mode": {
+                "label": "B-frames as references",
+                **self.__show_when("Advanced NVENC"),
+                "input_type":     "select",
+                "select_options": [
+                    {'value': mode, 'label': mode}
+                    for mode in ("disabled", "each", "middle")
+                ],
+            },
+            "Fragmented MP4": self.__show_when_container(".mp4"),
+            "Enable Audio Filter": self.__show_when("Copy Audio", inverted=True),
             "-af" : self.__show_when("Enable Audio Filter")
         }
     
-    def __show_when_gpu_decoding(self, key) -> Dict|bool:
-        values = {
-            "display":'hidden'
-        }
+    def __show_when_gpu_decoding(self, key) -> Mapping:
         if self.get_setting("Enable Hardware Decoding") and self.get(key):
-            values = {}
-        return values
-    
-    def __show_when_cpu_decoding(self, key) -> Dict|bool:
-        values = {
-            "display":'hidden'
-        }
+            return FORM_VISIBLE
+        return FORM_HIDDEN
+
+    def __show_when_cpu_decoding(self, key) -> Mapping:
         if not self.get_setting("Enable Hardware Decoding") and self.get(key):
-            values = {}
-        return values
-
-    def __show_when(self, key):
-        values = {}
-        if not self.get_setting(key):
-            values["display"] = 'hidden'
-        return values
-    
-    def __hidden_when(self, key):
-        values = {}
-        if self.get_setting(key) :
-            values["display"] = 'hidden'
-        return values
-    
+            return FORM_VISIBLE
+        return FORM_HIDDEN
+
+    def __show_when_container(self, extension) -> Mapping:
+        if self.get_setting("Container") == extension:
+            return FORM_VISIBLE
+        return FORM_HIDDEN
+
+    def __show_when(self, key, inverted=False) -> Mapping:
+        """Show the form field when the key setting is enabled, or when it is disabled if inverted"""
+        if bool(self.get_setting(key)) != inverted:
+            return FORM_VISIBLE
+        return FORM_HIDDEN
+
     def get(self, key, default_value=""):
         value = super(Settings, self).get_setting(key)
         if value is None:
@@ -224,20 +334,102 @@ class PluginStreamMapper(StreamMapper):
         )
         self.found_video = False
         self.found_audio = False
+        # Encode with libx265 on the CPU, for ffmpeg builds without hevc_nvenc
+        self.software_encoding = False
     
-    def set_settings(self, setting: Settings):
+    def set_settings(self, setting: Dict):
         self.setting = setting
         self.stream_types = []
 
-        if not setting.get("Copy Video"):
+        if not setting["Copy Video"]:
             self.stream_types.append("video")
         
-        if not setting.get("Copy Audio"):
+        if not setting["Copy Audio"]:
             self.stream_types.append("audio")
         
     def test_stream_needs_processing(self, stream_info: Dict):
         return stream_info.get("codec_type") in self.stream_types
     
+    def __preset(self, stream_info: Dict) -> str:
+        """
+        Return the configured preset, or pick one from the output height
+        when the preset has been left at its default.
+
+        :param stream_info:
+        :return: str
+        """
+        preset = self.setting["-preset"]
+        if preset != Settings.settings["-preset"]:
+            return preset
+        height = get_output_height(self.setting, stream_info)
+        for min_height, height_preset in PRESET_BY_HEIGHT:
+            if height >= min_height:
+                return height_preset
+        return preset
+
+    def __rate_control_args(self) -> List:
+        """
+        Build the NVENC rate control arguments.
+        When qmin and qmax clamp the quality to the -cq target, VBR can not change
+        the quantizer anyway, so constant QP is used instead.
+        The lookahead only feeds the VBR rate control, constant QP ignores it.
+
+        :return: list
+        """
+        cq = int(self.setting["-cq"])
+        qmin = int(self.setting["-qmin"])
+        qmax = int(self.setting["-qmax"])
+        if self.setting["Constant QP"] or qmin == qmax == cq:
+            return [*NVENC_CONSTQP_ARGS, "-qp", f"{cq}"]
+        return [
+            *NVENC_VBR_ARGS, "-cq", f"{cq}", "-qmin", f"{qmin}", "-qmax", f"{qmax}",
+            "-rc-lookahead", f"{self.setting['-rc-lookahead']}",
+        ]
+
+    def __nvenc_args(self, stream_info: Dict) -> List:
+        """
+        Build the hevc_nvenc encoder arguments.
+
+        :param stream_info:
+        :return: list
+        """
+        encoder_args = [
+            *NVENC_ENCODER_ARGS,
+            "-preset", self.__preset(stream_info),
+            *self.__rate_control_args(),
+        ]
+        if self.setting["Adaptive Quantization"]:
+            encoder_args.extend(NVENC_AQ_ARGS)
+        if self.setting["-multipass"] != "disabled":
+            encoder_args += ["-multipass", self.setting["-multipass"]]
+        if self.setting["Advanced NVENC"]:
+            encoder_args += ["-tune", self.setting["-tune"], "-bf", f"{self.setting['-bf']}"]
+            if int(self.setting["-bf"]) > 0:
+                # Only use B-frames as references when the encoder produces them
+                encoder_args += ["-b_ref_mode", self.setting["-b_ref_mode"]]
+        return encoder_args
+
+    def __x265_args(self, stream_info: Dict) -> List:
+        """
+        Build libx265 encoder arguments with the same preset and rate control intent as NVENC.
+        Constant QP maps to -qp, VBR with a quality target maps to -crf within the qmin/qmax range.
+
+        :param stream_info:
+        :return: list
+        """
+        encoder_args = [
+            *X265_ENCODER_ARGS,
+            "-preset", X265_PRESETS.get(self.__preset(stream_info), "medium"),
+        ]
+        cq = int(self.setting["-cq"])
+        qmin = int(self.setting["-qmin"])
+        qmax = int(self.setting["-qmax"])
+        if self.setting["Constant QP"] or qmin == qmax == cq:
+            encoder_args += ["-qp", f"{cq}"]
+        else:
+            encoder_args += ["-crf", f"{cq}", "-qmin", f"{qmin}", "-qmax", f"{qmax}"]
+        return encoder_args
+
     def custom_stream_mapping(self, stream_info: Dict, stream_id: int):
         """
         Will be provided with stream_info and the stream_id of a stream that has been 
@@ -270,41 +462,23 @@ class PluginStreamMapper(StreamMapper):
             if self.found_video :
                 logger.warning(f"a video track has been founded, track {stream_id} will be delete")
             else:
-                self.stream_mapping += [
+                stream_mapping = [
                     "-map", f"0:v:{stream_id}",
                     "-disposition:v:0", "default"
                 ]
 
-                vf_param = []
-                def vf_adder(condition, key):
-                    if self.setting.get(condition):
-                        vf_param.append(
-                            key + self.setting.get(key)
-                        )
-                if self.setting.get("Enable Hardware Decoding"):
-                    vf_adder("Enable Filter", "bilateral_cuda=")
-                    vf_adder("Change Resolution", "scale_cuda=")
+                if self.setting["Enable Hardware Decoding"]:
+                    video_filters = GPU_VIDEO_FILTERS
                 else:
-                    vf_adder("Enable Filter", "hqdn3d=")
-                    vf_adder("Change Resolution", "scale=")
-                    vf_adder("Change FPS", "fps=")
-                    vf_adder("Crop Window", "crop=")
-                if len(vf_param) > 0:
-                    vf_param = [
-                        "-vf", ",".join(vf_param)
-                    ]
-
-                cq = str(self.setting.get("-cq"))
-                qmin = str(self.setting.get("-qmin"))
-                qmax = str(self.setting.get("-qmax"))
-                lookahead = str(self.setting.get("-rc-lookahead"))
-
-                stream_encoding = [
-                    *vf_param,
-                    "-c:v:0", "hevc_nvenc",
-                    "-preset", self.setting.get("-preset"), "-rc", "vbr",
-                    "-cq", cq, "-qmin", qmin, "-qmax", qmax, "-rc-lookahead", lookahead,
-                ]
+                    video_filters = CPU_VIDEO_FILTERS
+                vf_param = build_filter_args(self.setting, video_filters)
+
+                if self.software_encoding:
+                    encoder_args = self.__x265_args(stream_info)
+                else:
+                    encoder_args = self.__nvenc_args(stream_info)
+
+                stream_encoding = [*vf_param, *encoder_args]
 
                 self.found_video = True
         
@@ -312,26 +486,164 @@ class PluginStreamMapper(StreamMapper):
             if self.found_audio:
                 logger.warning(f"a audio track has been founded, track {stream_id} will be delete")
             else:
-                self.stream_mapping += [
+                stream_mapping = [
                     "-map", f"0:a:{stream_id}",
                     "-disposition:a:0", "default"
                 ]
-                stream_encoding = [
-                    "-c:a:0", "aac"
-                ]
-                if self.setting.get("Enable Audio Filter"):
-                    stream_encoding.extend(
-                        ["-af", self.setting.get("-af")]
-                        )
-                stream_encoding.extend(
-                    ["-b:a", "192k", "-ac", "2"]
-                    )
+                stream_encoding = list(AAC_ENCODER_ARGS)
+                if self.setting["Enable Audio Filter"]:
+                    stream_encoding.extend(("-af", self.setting["-af"]))
+                stream_encoding.extend(AAC_OUTPUT_ARGS)
                 self.found_audio = True
         else:
             raise ValueError(f"Error codec type: {codec_type}")
 
         return {"stream_mapping": stream_mapping, "stream_encoding": stream_encoding}
 
+def build_filter_args(settings: Dict, video_filters) -> List:
+    """
+    Join the enabled filters of a filter table into a single -vf argument.
+
+    :param settings:
+    :param video_filters: a table of (toggle setting, filter setting) pairs
+    :return: list - the -vf arguments, or an empty list when no filter is enabled
+    """
+    vf = ",".join(
+        key + settings[key]
+        for condition, key in video_filters
+        if settings[condition]
+    )
+    if vf:
+        return ["-vf", vf]
+    return []
+
+
+def get_output_height(settings: Dict, stream_info: Dict) -> int:
+    """
+    Estimate the height of the encoded video from the source stream and the crop and scale settings.
+
+    :param settings:
+    :param stream_info:
+    :return: int - 0 when the height is unknown
+    """
+    width = int(stream_info.get("width") or 0)
+    height = int(stream_info.get("height") or 0)
+    try:
+        if settings["Change Resolution"]:
+            scale = settings["scale_cuda="] if settings["Enable Hardware Decoding"] else settings["scale="]
+            # Accept both "1920:-1" and "w=1920:h=-1"
+            scale_width, scale_height = (int(value.split("=")[-1]) for value in scale.split(":")[:2])
+            if scale_height > 0:
+                height = scale_height
+            elif scale_width > 0 and width > 0:
+                # Height follows the aspect ratio of the source
+                height = height * scale_width // width
+        if settings["Crop Window"]:
+            # The crop window is taken from the scaled frame
+            height = int(settings["crop="].split(":")[1])
+    except (IndexError, ValueError):
+        pass
+    return height
+
+
+def get_video_stream(probe: Probe) -> Dict:
+    """Return the first video stream in the probe, or an empty dict"""
+    for stream_info in probe.get("streams", []):
+        if stream_info.get("codec_type") == "video":
+            return stream_info
+    return {}
+
+
+def build_cuvid_crop(crop: str, width, height) -> str:
+    """
+    Convert a crop filter value (w:h:x:y) into the CUVID decoder
+    crop option (top x bottom x left x right).
+
+    :param crop:
+    :param width: source video width
+    :param height: source video height
+    :return: str - the decoder crop value, or an empty string if it can not be applied
+    """
+    try:
+        w, h, x, y = (int(part) for part in crop.split(":"))
+        top, bottom = y, int(height) - h - y
+        left, right = x, int(width) - w - x
+    except (TypeError, ValueError):
+        return ""
+    if min(top, bottom, left, right) < 0:
+        return ""
+    return "{}x{}x{}x{}".format(top, bottom, left, right)
+
+
+def get_thread_count(settings: Dict) -> int:
+    """
+    Return the number of ffmpeg threads to use.
+    Unmanic does not tell plugins how many workers run in parallel, so when the
+    setting is left at 0 ffmpeg keeps its own per decoder and filter defaults.
+
+    :param settings:
+    :return: int - 0 when ffmpeg should pick the thread counts
+    """
+    return max(0, int(settings["-threads"]))
+
+
+@lru_cache(maxsize=1)
+def get_ffmpeg_capabilities() -> frozenset:
+    """
+    Collect the names of the hardware accelerations, encoders and filters of the ffmpeg build.
+    ffmpeg is only queried once per process, every task reuses the result.
+
+    :return: frozenset - empty when ffmpeg could not be queried
+    """
+    names = set()
+    for option in ("-hwaccels", "-encoders", "-filters"):
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-hide_banner", option], capture_output=True, text=True, timeout=30
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("Unable to query ffmpeg {}: {}".format(option, e))
+            continue
+        # Each listing line starts with the name, optionally preceded by a flags column
+        for line in result.stdout.splitlines():
+            names.update(line.split()[:2])
+    return frozenset(names)
+
+
+def ffmpeg_supports(name: str) -> bool:
+    """Check if the ffmpeg build provides a hwaccel, encoder or filter. Assume it does when ffmpeg could not be queried."""
+    capabilities = get_ffmpeg_capabilities()
+    return not capabilities or name in capabilities
+
+
+def hardware_decoding_supported(settings: Dict, video_stream: Dict) -> bool:
+    """
+    Check if ffmpeg provides CUDA decoding and every GPU filter that is enabled in the settings.
+    The GPU chain has no crop filter, so a crop also needs a CUVID decoder for the source codec
+    and a crop window that fits inside the source frame. The decoder crops before the scale,
+    so a crop of the scaled frame can not be done there.
+
+    :param settings:
+    :param video_stream: the probed video stream
+    :return: bool
+    """
+    if not ffmpeg_supports("cuda"):
+        return False
+    if settings["Crop Window"]:
+        if settings["Change Resolution"]:
+            return False
+        decoder = CUVID_DECODERS.get(video_stream.get("codec_name"))
+        if not decoder or not ffmpeg_supports(decoder):
+            return False
+        if not build_cuvid_crop(settings["crop="], video_stream.get("width"), video_stream.get("height")):
+            return False
+    return all(
+        ffmpeg_supports(key.rstrip("="))
+        for condition, key in GPU_VIDEO_FILTERS
+        if settings[condition]
+    )
+
+
 def on_worker_process(data:Dict):
     """
     Runner function - enables additional configured processing jobs during the worker stages of a task.
@@ -360,27 +672,79 @@ def on_worker_process(data:Dict):
         settings = Settings(library_id=data.get("library_id"))
     else:
         settings = Settings()
-    
+
+    # Snapshot all settings once rather than reading them back on every lookup
+    settings_dict = settings.get_setting()
+
+    video_stream = get_video_stream(probe)
+
+    software_encoding = not settings_dict["Copy Video"] and not ffmpeg_supports("hevc_nvenc")
+    if software_encoding:
+        logger.warning("This ffmpeg build does not provide hevc_nvenc, encoding '{}' with libx265".format(abspath))
+        # Frames decoded into GPU memory could not be fed to the CPU encoder
+        settings_dict = {**settings_dict, "Enable Hardware Decoding": False}
+    elif settings_dict["Enable Hardware Decoding"] and not hardware_decoding_supported(settings_dict, video_stream):
+        logger.warning("Unable to decode '{}' with CUDA and the configured filters, decoding on the CPU".format(abspath))
+        # Copy before the override so the cached settings are left untouched
+        settings_dict = {**settings_dict, "Enable Hardware Decoding": False}
+
     # Get stream mapper
     mapper = PluginStreamMapper()
-    mapper.set_settings(settings)
+    mapper.set_settings(settings_dict)
+    mapper.software_encoding = software_encoding
     mapper.set_probe(probe)
 
-    mapper.streams_need_processing()
+    needs_processing = mapper.streams_need_processing()
 
     mapper.set_input_file(abspath)
 
-    base, _ = os.path.splitext(data.get("file_out"))
-    file_out = base + settings.get("Container")
+    # Skip the task when every stream would be copied into the same container
+    if not needs_processing and not mapper.container_needs_remuxing(settings_dict["Container"]):
+        logger.info("File '{}' already matches the output settings, nothing to do".format(abspath))
+        return data
+
+    # Swap the extension for the configured container, ignoring dots in the directory names
+    file_out = data.get("file_out")
+    dot = file_out.rfind(".")
+    if dot > file_out.rfind(os.sep):
+        file_out = file_out[:dot]
+    file_out += settings_dict["Container"]
     mapper.set_output_file(file_out)
     data["file_out"] = file_out
 
+    # The mp4 muxer options are ignored by other containers. Fragmenting writes
+    # the file in a single pass instead of rewriting the moov atom at the end,
+    # the muxer disables faststart when it is combined with fragmentation.
+    if settings_dict["Container"] == ".mp4":
+        if settings_dict["Fragmented MP4"]:
+            mapper.set_ffmpeg_advanced_options("-movflags", "+frag_keyframe+empty_moov")
+        else:
+            mapper.set_ffmpeg_advanced_options("-movflags", "+faststart")
+
+    # Limit the decoder and filter threads of this worker
+    threads = get_thread_count(settings_dict)
+    if threads > 0:
+        mapper.generic_options += ["-threads", f"{threads}", "-filter_threads", f"{threads}"]
+
+    # Enable CUDA hardware decoding if configured
+    if settings_dict["Enable Hardware Decoding"] and not settings_dict["Copy Video"]:
+        mapper.generic_options.extend(CUDA_HWACCEL_ARGS)
+        # Select the matching CUVID decoder so decoding never falls back to software
+        decoder = CUVID_DECODERS.get(video_stream.get("codec_name"))
+        if decoder:
+            mapper.generic_options += ["-c:v", decoder]
+        if settings_dict["Crop Window"]:
+            # Crop in the decoder so frames never need a round trip to system memory.
+            # hardware_decoding_supported() made sure the decoder can apply it.
+            mapper.generic_options += ["-crop", build_cuvid_crop(
+                settings_dict["crop="], video_stream.get("width"), video_stream.get("height")
+            )]
+
     ffmpeg_args = mapper.get_ffmpeg_args()
     logger.debug("ffmpeg_args: '{}'".format(ffmpeg_args))
 
     # Apply ffmpeg args to command
-    data["exec_command"] = ["ffmpeg"]
-    data["exec_command"] += ffmpeg_args
+    data["exec_command"] = ["ffmpeg"] + ffmpeg_args
 
     parser = Parser(logger)
     parser.set_probe(probe)
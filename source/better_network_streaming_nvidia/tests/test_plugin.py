@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit tests for better_network_streaming_nvidia plugin.
+"""
+
+import unittest
+import sys
+import os
+from unittest.mock import Mock, patch
+
+# Add the plugin directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Create mock modules
+mock_unmanic = Mock()
+mock_unmanic.libs = Mock()
+mock_unmanic.libs.unplugins = Mock()
+mock_unmanic.libs.unplugins.settings = Mock()
+
+# Mock PluginSettings class
+mock_plugin_settings_class = Mock
+mock_unmanic.libs.unplugins.settings.PluginSettings = mock_plugin_settings_class
+
+
+# Create a fake StreamMapper class with the attributes the plugin sets up
+class FakeStreamMapper:
+    """Fake StreamMapper class for testing."""
+
+    def __init__(self, logger, processing_stream_type):
+        self.logger = logger
+        self.processing_stream_type = processing_stream_type
+
+
+# Mock ffmpeg modules
+mock_ffmpeg = Mock()
+mock_ffmpeg.Parser = Mock
+mock_ffmpeg.Probe = Mock
+mock_ffmpeg.StreamMapper = FakeStreamMapper
+
+# Patch the imports
+sys.modules['unmanic'] = mock_unmanic
+sys.modules['unmanic.libs'] = mock_unmanic.libs
+sys.modules['unmanic.libs.unplugins'] = mock_unmanic.libs.unplugins
+sys.modules['unmanic.libs.unplugins.settings'] = mock_unmanic.libs.unplugins.settings
+sys.modules['steam_selector'] = Mock()
+sys.modules['steam_selector.lib'] = Mock()
+sys.modules['steam_selector.lib'].ffmpeg = mock_ffmpeg
+sys.modules['steam_selector.lib.ffmpeg'] = mock_ffmpeg
+
+# Now import the plugin
+import plugin
+from plugin import (
+    CPU_VIDEO_FILTERS,
+    PluginStreamMapper,
+    Settings,
+    build_cuvid_crop,
+    build_filter_args,
+    get_output_height,
+    hardware_decoding_supported,
+)
+
+# Capabilities of an ffmpeg build with CUDA decoding and the GPU filters
+CUDA_CAPABILITIES = frozenset({
+    "cuda", "h264_cuvid", "hevc_cuvid", "hevc_nvenc", "scale_cuda", "bilateral_cuda",
+})
+
+
+def make_settings(**overrides):
+    """Return the default plugin settings with some values overridden."""
+    settings = dict(Settings.settings)
+    settings.update(overrides)
+    return settings
+
+
+class TestBuildCuvidCrop(unittest.TestCase):
+    """Test cases for build_cuvid_crop."""
+
+    def test_letterbox_crop(self):
+        """Test the default letterbox crop on a 1080p source."""
+        self.assertEqual(build_cuvid_crop("1920:804:0:138", 1920, 1080), "138x138x0x0")
+
+    def test_offset_crop(self):
+        """Test a crop that removes a different amount from every side."""
+        # top 50, bottom 1080 - 720 - 50, left 100, right 1920 - 1280 - 100
+        self.assertEqual(build_cuvid_crop("1280:720:100:50", 1920, 1080), "50x310x100x540")
+
+    def test_probe_values_as_strings(self):
+        """Test that width and height are accepted as probed strings."""
+        self.assertEqual(build_cuvid_crop("1920:804:0:138", "1920", "1080"), "138x138x0x0")
+
+    def test_crop_outside_frame(self):
+        """Test that a crop larger than the source frame can not be applied."""
+        self.assertEqual(build_cuvid_crop("1920:804:0:138", 1280, 720), "")
+        self.assertEqual(build_cuvid_crop("1920:804:0:300", 1920, 1080), "")
+
+    def test_malformed_crop(self):
+        """Test that malformed crops or unknown frame sizes can not be applied."""
+        self.assertEqual(build_cuvid_crop("1920:804", 1920, 1080), "")
+        self.assertEqual(build_cuvid_crop("1920:804:0:top", 1920, 1080), "")
+        self.assertEqual(build_cuvid_crop("1920:804:0:138", None, None), "")
+
+
+class TestGetOutputHeight(unittest.TestCase):
+    """Test cases for get_output_height."""
+
+    def test_source_height(self):
+        """Test that the source height is used without crop or scale."""
+        stream_info = {"width": 1920, "height": 1080}
+        self.assertEqual(get_output_height(make_settings(), stream_info), 1080)
+
+    def test_scale_follows_aspect_ratio(self):
+        """Test that a scale with an automatic height keeps the source aspect ratio."""
+        stream_info = {"width": 3840, "height": 2160}
+        settings = make_settings(**{"Change Resolution": True, "scale=": "w=1920:h=-1"})
+        self.assertEqual(get_output_height(settings, stream_info), 1080)
+
+    def test_hardware_scale(self):
+        """Test that scale_cuda is used with hardware decoding."""
+        stream_info = {"width": 3840, "height": 2160}
+        settings = make_settings(**{
+            "Enable Hardware Decoding": True,
+            "Change Resolution": True,
+            "scale_cuda=": "1280:-1",
+        })
+        self.assertEqual(get_output_height(settings, stream_info), 720)
+
+    def test_crop_after_scale(self):
+        """Test that the crop height is taken from the scaled frame."""
+        stream_info = {"width": 3840, "height": 2160}
+        settings = make_settings(**{"Change Resolution": True, "Crop Window": True})
+        self.assertEqual(get_output_height(settings, stream_info), 804)
+
+    def test_unknown_height(self):
+        """Test that an unknown source height is reported as 0."""
+        self.assertEqual(get_output_height(make_settings(), {}), 0)
+
+
+class TestHardwareDecodingSupported(unittest.TestCase):
+    """Test cases for hardware_decoding_supported."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.video_stream = {"codec_name": "h264", "width": 1920, "height": 1080}
+        self.settings = make_settings(**{"Enable Hardware Decoding": True})
+
+    def supported(self, capabilities, settings, video_stream):
+        with patch.object(plugin, "get_ffmpeg_capabilities", return_value=capabilities):
+            return hardware_decoding_supported(settings, video_stream)
+
+    def test_supported(self):
+        """Test a build with CUDA decoding and no filters enabled."""
+        self.assertTrue(self.supported(CUDA_CAPABILITIES, self.settings, self.video_stream))
+
+    def test_without_cuda(self):
+        """Test that a build without CUDA decodes on the CPU."""
+        capabilities = CUDA_CAPABILITIES - {"cuda"}
+        self.assertFalse(self.supported(capabilities, self.settings, self.video_stream))
+
+    def test_missing_gpu_filter(self):
+        """Test that an enabled GPU filter missing from the build decodes on the CPU."""
+        self.settings["Enable Video Filter"] = True
+        capabilities = CUDA_CAPABILITIES - {"bilateral_cuda"}
+        self.assertFalse(self.supported(capabilities, self.settings, self.video_stream))
+
+    def test_crop_with_cuvid_decoder(self):
+        """Test that a crop is done by the CUVID decoder of the source codec."""
+        self.settings["Crop Window"] = True
+        self.assertTrue(self.supported(CUDA_CAPABILITIES, self.settings, self.video_stream))
+
+    def test_crop_without_cuvid_decoder(self):
+        """Test that a crop of a codec without a CUVID decoder falls back to the CPU chain."""
+        self.settings["Crop Window"] = True
+        self.video_stream["codec_name"] = "prores"
+        self.assertFalse(self.supported(CUDA_CAPABILITIES, self.settings, self.video_stream))
+
+        # The CPU chain applies the crop as a filter
+        cpu_settings = dict(self.settings, **{"Enable Hardware Decoding": False})
+        self.assertEqual(
+            build_filter_args(cpu_settings, CPU_VIDEO_FILTERS),
+            ["-vf", "crop=1920:804:0:138"],
+        )
+
+    def test_crop_with_cuvid_decoder_missing_from_build(self):
+        """Test that a crop falls back to the CPU when the build lacks the CUVID decoder."""
+        self.settings["Crop Window"] = True
+        capabilities = CUDA_CAPABILITIES - {"h264_cuvid"}
+        self.assertFalse(self.supported(capabilities, self.settings, self.video_stream))
+
+    def test_crop_outside_frame(self):
+        """Test that a crop the decoder can not express falls back to the CPU."""
+        self.settings["Crop Window"] = True
+        self.video_stream.update(width=1280, height=720)
+        self.assertFalse(self.supported(CUDA_CAPABILITIES, self.settings, self.video_stream))
+
+    def test_crop_with_scale(self):
+        """Test that a crop of the scaled frame falls back to the CPU."""
+        self.settings["Crop Window"] = True
+        self.settings["Change Resolution"] = True
+        self.assertFalse(self.supported(CUDA_CAPABILITIES, self.settings, self.video_stream))
+
+    def test_unknown_capabilities(self):
+        """Test that hardware decoding is assumed when ffmpeg could not be queried."""
+        self.settings["Crop Window"] = True
+        self.assertTrue(self.supported(frozenset(), self.settings, self.video_stream))
+
+
+class TestPresetSelection(unittest.TestCase):
+    """Test cases for the NVENC preset chosen from the output height."""
+
+    def preset(self, stream_info, **overrides):
+        mapper = PluginStreamMapper()
+        mapper.set_settings(make_settings(**overrides))
+        return mapper._PluginStreamMapper__preset(stream_info)
+
+    def test_default_preset_below_1440(self):
+        """Test that outputs below 1440p use the slowest preset."""
+        self.assertEqual(self.preset({"width": 1920, "height": 1080}), "p7")
+        self.assertEqual(self.preset({"width": 2560, "height": 1439}), "p7")
+
+    def test_default_preset_from_1440(self):
+        """Test that outputs of 1440p and above use p6."""
+        self.assertEqual(self.preset({"width": 2560, "height": 1440}), "p6")
+        self.assertEqual(self.preset({"width": 3840, "height": 2160}), "p6")
+
+    def test_preset_follows_output_height(self):
+        """Test that the height after scaling decides the preset."""
+        stream_info = {"width": 3840, "height": 2160}
+        self.assertEqual(self.preset(stream_info, **{"Change Resolution": True}), "p7")
+
+    def test_unknown_height(self):
+        """Test that an unknown height keeps the default preset."""
+        self.assertEqual(self.preset({}), "p7")
+
+    def test_explicit_preset(self):
+        """Test that a preset chosen by the user is always kept."""
+        self.assertEqual(self.preset({"width": 3840, "height": 2160}, **{"-preset": "p5"}), "p5")
+        self.assertEqual(self.preset({"width": 1920, "height": 1080}, **{"-preset": "p2"}), "p2")
+
+
+if __name__ == '__main__':
+    unittest.main()
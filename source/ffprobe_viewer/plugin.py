@@ -41,9 +41,13 @@
 
 """
 import os
+from types import MappingProxyType
 
 from unmanic.libs.unplugins.settings import PluginSettings
-from unmanic.libs.system import System
+
+# Shared, read-only form visibility values
+FORM_VISIBLE = MappingProxyType({})
+FORM_HIDDEN = MappingProxyType({"display": 'hidden'})
 
 
 class Settings(PluginSettings):
@@ -59,10 +63,10 @@ class Settings(PluginSettings):
         }
 
     def __set_allowed_extensions_form_settings(self):
-        values = {}
         if self.get_setting('Run'):
-            values["display"] = 'hidden'
-        return values
+            return FORM_HIDDEN
+        return FORM_VISIBLE
+
 
 def on_worker_process(data):
     """
@@ -81,12 +85,20 @@ def on_worker_process(data):
     """
     settings = Settings(library_id=data.get('library_id'))
 
-    if settings.get_setting("Run"):
+    # Snapshot all settings once rather than reading them back on every lookup
+    settings_dict = settings.get_setting()
+
+    if settings_dict["Run"]:
         data['exec_command'] = [
             "ffprobe",
+            "-hide_banner",
+            "-loglevel", "error",
+            "-of", "json",
+            "-show_streams",
+            "-show_format",
             "-i", data['file_in']
         ]
     else:
         data['exec_command'] = [
-            "echo", settings.get_setting("Empty echo")
+            "echo", settings_dict["Empty echo"]
         ]
\ No newline at end of file
@@ -25,7 +25,9 @@ import hashlib
 import json
 import logging
 import os
+import re
 from configparser import NoSectionError, NoOptionError
+from functools import lru_cache
 
 from unmanic.libs.directoryinfo import UnmanicDirectoryInfo
 from unmanic.libs.unplugins.settings import PluginSettings
@@ -33,6 +35,10 @@ from unmanic.libs.unplugins.settings import PluginSettings
 # Configure plugin logger
 logger = logging.getLogger("Unmanic.Plugin.mover2")
 
+# Placeholders like {$s}, {$e} or {$name} in the search pattern and rename template
+PLACEHOLDER_RE = re.compile(r'\{\$([A-Za-z0-9_]+)\}')
+PLACEHOLDER_SPLIT_RE = re.compile(r'(\{\$[A-Za-z0-9_]+\})')
+
 
 class Settings(PluginSettings):
     settings = {
@@ -116,10 +122,29 @@ def transform_basename(basename: str, search: str, template: str):
         -> "format_name_S03E32"
     """
 
-    import re
-    PLACEHOLDER_RE = re.compile(r'\{\$([A-Za-z0-9_]+)\}')
+    regex = compile_search_pattern(search)
+
+    m = regex.match(basename)
+    if not m:
+        return None
+
+    # replace placeholders in template with matched group values (missing -> empty string)
+    def repl(match_obj):
+        key = match_obj.group(1)
+        return m.groupdict().get(key, '')
+
+    result = PLACEHOLDER_RE.sub(repl, template)
+    return result
+
+
+@lru_cache(maxsize=32)
+def compile_search_pattern(search: str):
+    """
+    Build the regex matching a search pattern with placeholders.
+    The search pattern is a plugin setting, so every file of a library reuses the compiled regex.
+    """
     # split search into literal and placeholder tokens
-    parts = re.split(r'(\{\$[A-Za-z0-9_]+\})', search)
+    parts = PLACEHOLDER_SPLIT_RE.split(search)
     # collect placeholder names in order
     placeholders = [m.group(1) for m in PLACEHOLDER_RE.finditer(search)]
     if not placeholders and '{' in search:
@@ -146,19 +171,7 @@ def transform_basename(basename: str, search: str, template: str):
             pattern_parts.append(re.escape(part))
 
     pattern = '^' + ''.join(pattern_parts) + '$'
-    regex = re.compile(pattern)
-
-    m = regex.match(basename)
-    if not m:
-        return None
-
-    # replace placeholders in template with matched group values (missing -> empty string)
-    def repl(match_obj):
-        key = match_obj.group(1)
-        return m.groupdict().get(key, '')
-
-    result = PLACEHOLDER_RE.sub(repl, template)
-    return result
+    return re.compile(pattern)
 
 
 def get_file_out(settings, original_source_path, file_out, library_id=None):
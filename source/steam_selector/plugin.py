@@ -43,16 +43,34 @@
 
 import logging
 import os
+import re
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import Dict, List
+from types import MappingProxyType
+from typing import Dict, List, Mapping
 
 from unmanic.libs.unplugins.settings import PluginSettings
-from unmanic.libs.system import System
 from steam_selector.lib.ffmpeg import Parser, Probe, StreamMapper
 
 # Configure plugin logger
 logger = logging.getLogger("Unmanic.Plugin.steam_selector")
 
+# Shared, read-only form visibility values
+FORM_VISIBLE = MappingProxyType({})
+FORM_HIDDEN = MappingProxyType({"display": 'hidden'})
+
+# Stream specifier of each stream type
+STREAM_IDENTS = MappingProxyType({
+    "video": "v",
+    "audio": "a",
+    "subtitle": "s",
+})
+
+# Tags used for streams that have none
+EMPTY_TAGS = MappingProxyType({})
+# Codecs used for stream types that can not be selected by codec, like subtitles
+EMPTY_CODECS = frozenset()
+
 class Settings(PluginSettings):
     settings = {
         "Copy all the video": True,
@@ -65,27 +83,22 @@ class Settings(PluginSettings):
         "Search keywords in subtitle tag": "",
     }
 
-    def __init__(self, *args, **kwargs):
-        super(Settings, self).__init__(*args, **kwargs)
-        self.form_settings = {
-            "Select video codec": self.__hidden_when("Copy all the video"),
-            "Search keywords in video tag": self.__hidden_when("Copy all the video"),
-            "Select audio codec": self.__hidden_when("Copy all the audio"),
-            "Search keywords in audio tag": self.__hidden_when("Copy all the audio"),
-            "Search keywords in subtitle tag": self.__hidden_when("Copy all the subtitle"),
+    @cached_property
+    def form_settings(self):
+        """Only built when the WebUI asks for the form, the worker runner never needs it"""
+        return {
+            "Select video codec": self.__show_when("Copy all the video", inverted=True),
+            "Search keywords in video tag": self.__show_when("Copy all the video", inverted=True),
+            "Select audio codec": self.__show_when("Copy all the audio", inverted=True),
+            "Search keywords in audio tag": self.__show_when("Copy all the audio", inverted=True),
+            "Search keywords in subtitle tag": self.__show_when("Copy all the subtitle", inverted=True),
         }
 
-    def __show_when(self, key):
-        values = {}
-        if not self.get_setting(key):
-            values["display"] = 'hidden'
-        return values
-    
-    def __hidden_when(self, key):
-        values = {}
-        if self.get_setting(key):
-            values["display"] = 'hidden'
-        return values
+    def __show_when(self, key, inverted=False) -> Mapping:
+        """Show the form field when the key setting is enabled, or when it is disabled if inverted"""
+        if bool(self.get_setting(key)) != inverted:
+            return FORM_VISIBLE
+        return FORM_HIDDEN
     
     def get(self, key, default_value=""):
         value = super(Settings, self).get_setting(key)
@@ -105,54 +118,60 @@ class PluginStreamMapper(StreamMapper):
         self.select_codecs = None
         # A dict of keyword we interest
         self.search_strings = None
-        # A list of stream we interest
+        # A set of stream we interest
         self.stream_types = None
         # A dict of if or not select stream
         self.found_select_streams = None
+        # A dict of how many streams of each type were selected
+        self.__stream_counter = None
 
     def set_settings(self, settings: Settings):
         self.settings = settings
-        self.stream_types =[
+        # A frozenset, so test_stream_needs_processing is a hash lookup for every stream
+        self.stream_types = frozenset(
             stream_type
-            for stream_type in ["video", "audio", "subtitle"]
-            if not self.settings.get(
-                "Copy all the " + stream_type, True
-                )
-        ]
+            for stream_type in STREAM_IDENTS
+            if not self.settings.get("Copy all the " + stream_type, True)
+        )
+        # Codecs and keywords are lowercased once here, so every stream is matched without case folding them again
         self.select_codecs = {
-            stream_type : self.settings.get(
-                f"Select {stream_type} codec"
-            ).split()
+            stream_type : frozenset(
+                codec.lower()
+                for codec in self.settings.get(f"Select {stream_type} codec").split()
+            )
             for stream_type in self.stream_types
             if not stream_type == "subtitle"
         }
         self.search_strings = {
-            stream_type : self.settings.get(
-                "Search keywords in " + stream_type + " tag"
-            ).split()
+            stream_type : tuple(
+                search_string.lower()
+                for search_string in self.settings.get("Search keywords in " + stream_type + " tag").split()
+            )
             for stream_type in self.stream_types
         }
         self.found_select_streams = {
             stream_type : False
             for stream_type in self.stream_types
         }
+        self.__stream_counter = {
+            stream_type : 0
+            for stream_type in self.stream_types
+        }
 
     def test_stream_needs_processing(self, stream_info: Dict):
         return stream_info.get("codec_type") in self.stream_types
     
     def valid_select_stream(self, codec_type : str, stream_info: Dict):
-        stream_tags = stream_info.get("tags")
-
-        for search_string in self.search_strings.get(codec_type):
-            # Check if tag matches the "Search String"
-            if search_string.lower() in stream_tags.get("language", "").lower():
-                return True
-            if search_string in stream_tags.get("title", ""):
-                return True
-        for codec in self.select_codecs.get(codec_type):
-            if codec.lower() == stream_info.get("codec_name", "").lower():
-                return True 
-        return False
+        # Streams without tags, common for subtitles, may have no or a null "tags" entry
+        stream_tags = stream_info.get("tags") or EMPTY_TAGS
+        language = stream_tags.get("language", "").lower()
+        title = stream_tags.get("title", "").lower()
+
+        # Check if a language or title tag matches a "Search String"
+        search_pattern = compile_search_strings(self.search_strings.get(codec_type))
+        if search_pattern and (search_pattern.search(language) or search_pattern.search(title)):
+            return True
+        return stream_info.get("codec_name", "").lower() in self.select_codecs.get(codec_type, EMPTY_CODECS)
     
     def custom_stream_mapping(self, stream_info: Dict, stream_id: int):
         """
@@ -177,43 +196,27 @@ class PluginStreamMapper(StreamMapper):
         :param stream_id:
         :return: dict
         """
-        ident = {
-            "video": "v",
-            "audio": "a",
-            "subtitle": "s",
-        }
-
         stream_mapping = []
         stream_encoding = []
 
         codec_type = stream_info.get("codec_type")
 
         if self.valid_select_stream(codec_type, stream_info):
-            if not self.found_select_streams.get(codec_type):
-                self.stream_mapping += [
-                    "-map",
-                    "0:{}:{}".format(ident.get(codec_type), stream_id),
-                    "-disposition:{}:{}".format(ident.get(codec_type), 0),
-                    "default",
-                ]
-                stream_encoding = [
-                    "-c:{}:{}".format(ident.get(codec_type), 0),
-                    "copy"
-                ]
-                self.__stream_counter = 1
-            else:
-                self.stream_mapping += [
-                    "-map",
-                    "0:{}:{}".format(ident.get(codec_type), self.__stream_counter ),
-                ]
-                self.__stream_counter += 1
+            ident = STREAM_IDENTS[codec_type]
+            # Selected streams of a type are numbered from 0 in the output file
+            output_id = self.__stream_counter[codec_type]
+            stream_mapping = ["-map", f"0:{ident}:{stream_id}"]
+            if output_id == 0:
+                stream_mapping += [f"-disposition:{ident}:0", "default"]
+            stream_encoding = [f"-c:{ident}:{output_id}", "copy"]
+            self.__stream_counter[codec_type] = output_id + 1
             self.found_select_streams[codec_type] = True
 
         return {"stream_mapping": stream_mapping, "stream_encoding": stream_encoding}
     
     def ready_to_select(self) -> bool:
-        if all([self.settings.get("Copy all the " + stream_type)
-                for stream_type in ["video", "audio", "subtitle"]]):
+        # set_settings only lists the stream types that are not copied
+        if not self.stream_types:
             return False
         else:
             self.streams_need_processing()
@@ -223,6 +226,28 @@ class PluginStreamMapper(StreamMapper):
                 logger.warning("None Streams were select, check out output file")
             return True
 
+@lru_cache(maxsize=16)
+def compile_search_strings(search_strings: tuple):
+    """
+    Compile the search strings of a stream type into a single pattern,
+    so a tag is scanned once for all of them.
+
+    :param search_strings: lowercased search strings
+    :return: compiled pattern, or None when there are no search strings
+    """
+    if not search_strings:
+        return None
+    return re.compile("|".join(re.escape(search_string) for search_string in search_strings))
+
+
+def copies_all_streams(settings: Settings) -> bool:
+    """Check if every stream type is set to be copied, which leaves nothing to select"""
+    return all(
+        settings.get("Copy all the " + stream_type)
+        for stream_type in STREAM_IDENTS
+    )
+
+
 def on_worker_process(data:Dict):
     """
     Runner function - enables additional configured processing jobs during the worker stages of a task.
@@ -240,17 +265,21 @@ def on_worker_process(data:Dict):
     """
     abspath = data.get("file_in")
 
-    # Get file probe
-    probe = Probe(logger, allowed_mimetypes=["video", "audio"])
-    if not probe.file(file_path=abspath):
-        # File not able to be probed by ffprobe. The file is probably not a audio/video file.
-        return
-    
     # Configure settings object
     if data.get("library_id"):
         settings = Settings(library_id=data.get("library_id"))
     else:
         settings = Settings()
+
+    # Nothing to select, skip probing the file
+    if copies_all_streams(settings):
+        return data
+
+    # Get file probe
+    probe = Probe(logger, allowed_mimetypes=["video", "audio"])
+    if not probe.file(file_path=abspath):
+        # File not able to be probed by ffprobe. The file is probably not a audio/video file.
+        return
     
     # Get stream mapper
     mapper = PluginStreamMapper()
@@ -82,7 +82,7 @@ class TestPluginStreamMapper(unittest.TestCase):
         self.mapper.set_settings(self.settings)
 
         # stream_types should be empty when copying all streams
-        self.assertEqual(self.mapper.stream_types, [])
+        self.assertEqual(self.mapper.stream_types, frozenset())
         self.assertEqual(self.mapper.select_codecs, {})
         self.assertEqual(self.mapper.search_strings, {})
         self.assertEqual(self.mapper.found_select_streams, {})
@@ -109,13 +109,13 @@ class TestPluginStreamMapper(unittest.TestCase):
         self.mapper.set_settings(self.settings)
 
         # Only video should be in stream_types
-        self.assertEqual(self.mapper.stream_types, ["video"])
+        self.assertEqual(self.mapper.stream_types, frozenset({"video"}))
 
         # Check select_codecs (only video, not subtitle)
-        self.assertEqual(self.mapper.select_codecs, {"video": ["hevc", "h264"]})
+        self.assertEqual(self.mapper.select_codecs, {"video": frozenset(["hevc", "h264"])})
 
         # Check search_strings
-        self.assertEqual(self.mapper.search_strings, {"video": ["eng", "english"]})
+        self.assertEqual(self.mapper.search_strings, {"video": ("eng", "english")})
 
         # Check found_select_streams
         self.assertEqual(self.mapper.found_select_streams, {"video": False})
@@ -123,7 +123,7 @@ class TestPluginStreamMapper(unittest.TestCase):
     def test_test_stream_needs_processing(self):
         """Test test_stream_needs_processing method."""
         # Set up mapper with video in stream_types
-        self.mapper.stream_types = ["video", "audio"]
+        self.mapper.stream_types = frozenset({"video", "audio"})
 
         # Test with video stream
         video_stream = {"codec_type": "video"}
@@ -140,8 +140,8 @@ class TestPluginStreamMapper(unittest.TestCase):
     def test_valid_select_stream_by_codec(self):
         """Test valid_select_stream with codec matching."""
         # Set up mapper
-        self.mapper.select_codecs = {"video": ["hevc", "h264"]}
-        self.mapper.search_strings = {"video": []}
+        self.mapper.select_codecs = {"video": frozenset(["hevc", "h264"])}
+        self.mapper.search_strings = {"video": ()}
 
         # Test with matching codec
         stream_info = {
@@ -162,8 +162,8 @@ class TestPluginStreamMapper(unittest.TestCase):
     def test_valid_select_stream_by_language(self):
         """Test valid_select_stream with language tag matching."""
         # Set up mapper
-        self.mapper.select_codecs = {"audio": []}
-        self.mapper.search_strings = {"audio": ["eng", "english"]}
+        self.mapper.select_codecs = {"audio": frozenset()}
+        self.mapper.search_strings = {"audio": ("eng", "english")}
 
         # Test with matching language
         stream_info = {
@@ -184,8 +184,8 @@ class TestPluginStreamMapper(unittest.TestCase):
     def test_valid_select_stream_by_title(self):
         """Test valid_select_stream with title tag matching."""
         # Set up mapper
-        self.mapper.select_codecs = {"audio": []}
-        self.mapper.search_strings = {"audio": ["Commentary", "Director"]}  # Match case
+        self.mapper.select_codecs = {"audio": frozenset()}
+        self.mapper.search_strings = {"audio": ("commentary", "director")}  # Lowercased by set_settings
 
         # Test with matching title
         stream_info = {
@@ -199,13 +199,40 @@ class TestPluginStreamMapper(unittest.TestCase):
         stream_info["tags"]["title"] = "Main Audio"
         self.assertFalse(self.mapper.valid_select_stream("audio", stream_info))
 
+        # Test case-insensitive matching
+        stream_info["tags"]["title"] = "DIRECTOR'S CUT"  # uppercase
+        self.assertTrue(self.mapper.valid_select_stream("audio", stream_info))
+
+    def test_valid_select_stream_without_tags(self):
+        """Test valid_select_stream with streams that have no tags."""
+        # Mock settings to select english subtitles only
+        def mock_get(key, default_value=""):
+            if key == "Copy all the subtitle":
+                return False
+            elif key == "Search keywords in subtitle tag":
+                return "eng"
+            else:
+                return True
+
+        self.settings.get.side_effect = mock_get
+
+        self.mapper.set_settings(self.settings)
+
+        # Test with missing tags
+        stream_info = {"codec_type": "subtitle", "codec_name": "subrip"}
+        self.assertFalse(self.mapper.valid_select_stream("subtitle", stream_info))
+
+        # Test with null tags
+        stream_info["tags"] = None
+        self.assertFalse(self.mapper.valid_select_stream("subtitle", stream_info))
+
     def test_custom_stream_mapping_first_match(self):
         """Test custom_stream_mapping for first matching stream."""
         # Set up mapper
         self.mapper.found_select_streams = {"video": False}
         self.mapper.stream_mapping = []
         # Set private attribute for stream counter
-        self.mapper._PluginStreamMapper__stream_counter = 0
+        self.mapper._PluginStreamMapper__stream_counter = {"video": 0}
 
         # Mock valid_select_stream to return True
         self.mapper.valid_select_stream = Mock(return_value=True)
@@ -214,53 +241,51 @@ class TestPluginStreamMapper(unittest.TestCase):
         stream_info = {"codec_type": "video"}
         result = self.mapper.custom_stream_mapping(stream_info, 0)
 
-        # Should return encoding for copy
+        # Should return the mapping as default stream and encoding for copy
         expected_result = {
-            "stream_mapping": [],
+            "stream_mapping": [
+                "-map", "0:v:0",
+                "-disposition:v:0", "default"
+            ],
             "stream_encoding": ["-c:v:0", "copy"]
         }
         self.assertEqual(result, expected_result)
 
-        # Check that stream_mapping was modified
-        expected_mapping = [
-            "-map", "0:v:0",
-            "-disposition:v:0", "default"
-        ]
-        self.assertEqual(self.mapper.stream_mapping, expected_mapping)
+        # Check that stream_mapping is left to the base class
+        self.assertEqual(self.mapper.stream_mapping, [])
 
         # Check that found_select_streams was updated
         self.assertTrue(self.mapper.found_select_streams["video"])
 
         # Check that stream counter was set
-        self.assertEqual(self.mapper._PluginStreamMapper__stream_counter, 1)
+        self.assertEqual(self.mapper._PluginStreamMapper__stream_counter, {"video": 1})
 
     def test_custom_stream_mapping_second_match(self):
         """Test custom_stream_mapping for second matching stream of same type."""
         # Set up mapper - already found one video stream
         self.mapper.found_select_streams = {"video": True}
         self.mapper.stream_mapping = []
-        self.mapper._PluginStreamMapper__stream_counter = 1
+        self.mapper._PluginStreamMapper__stream_counter = {"video": 1}
 
         # Mock valid_select_stream to return True
         self.mapper.valid_select_stream = Mock(return_value=True)
 
-        # Test with second video stream
+        # Test with third input video stream
         stream_info = {"codec_type": "video"}
-        result = self.mapper.custom_stream_mapping(stream_info, 1)
+        result = self.mapper.custom_stream_mapping(stream_info, 2)
 
-        # Should return empty mapping (no encoding for additional streams)
+        # Should map the input stream to the second output stream (no disposition for second stream)
         expected_result = {
-            "stream_mapping": [],
-            "stream_encoding": []
+            "stream_mapping": ["-map", "0:v:2"],
+            "stream_encoding": ["-c:v:1", "copy"]
         }
         self.assertEqual(result, expected_result)
 
-        # Check that stream_mapping was modified (no disposition for second stream)
-        expected_mapping = ["-map", "0:v:1"]
-        self.assertEqual(self.mapper.stream_mapping, expected_mapping)
+        # Check that stream_mapping is left to the base class
+        self.assertEqual(self.mapper.stream_mapping, [])
 
         # Check that stream counter was incremented
-        self.assertEqual(self.mapper._PluginStreamMapper__stream_counter, 2)
+        self.assertEqual(self.mapper._PluginStreamMapper__stream_counter, {"video": 2})
 
     def test_custom_stream_mapping_no_match(self):
         """Test custom_stream_mapping when stream doesn't match criteria."""
@@ -288,7 +313,7 @@ class TestPluginStreamMapper(unittest.TestCase):
         """Test ready_to_select when all streams are set to copy."""
         # Mock settings to copy all streams
         self.settings.get.side_effect = lambda key, default_value="": True
-        self.mapper.settings = self.settings
+        self.mapper.set_settings(self.settings)
 
         # Should return False when copying all streams
         self.assertFalse(self.mapper.ready_to_select())
@@ -307,7 +332,7 @@ class TestPluginStreamMapper(unittest.TestCase):
                 return default_value
 
         self.settings.get.side_effect = mock_get
-        self.mapper.settings = self.settings
+        self.mapper.set_settings(self.settings)
 
         # Mock streams_need_processing
         self.mapper.streams_need_processing = Mock()